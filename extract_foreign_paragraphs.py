@@ -1,109 +1,77 @@
 import streamlit as st
 import fitz  # PyMuPDF
-from langdetect import detect
-from collections import Counter
+from itertools import compress
+import numpy as np
 import pandas as pd
-import re
 import io
-from langdetect import detect
+import csv
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pycountry
-from langdetect import DetectorFactory
-
-#---------------------setting consistency------
-DetectorFactory.seed = 0
-
-
+from paragraph_extraction import extract_page_range, extract_paragraphs_from_pages, safe_detect
+
+logger = logging.getLogger(__name__)
+
+#---------------------language model------
+# optional: pip install fasttext and put lid.176.ftz next to this script (see README)
+FASTTEXT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lid.176.ftz")
+MIN_LANG_CONFIDENCE = 0.5
+UNKNOWN_LANGUAGE = "Unknown"
+MIN_PARALLEL_PARAGRAPHS = 64
+MIN_PARALLEL_PAGES = 8
+# every upload in the shared Streamlit server starts its own pool, so keep it small
+MAX_WORKERS = 4
+# opt-in transformer detector: a directory holding model_quantized.onnx (int8)
+# plus the matching tokenizer files and config.json (for id2label)
+USE_ONNX_DETECTOR = False
+ONNX_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lang_detect_onnx")
+ONNX_BATCH_SIZE = 32
 
 # ---------------------- Helper Functions ----------------------
 
-def is_valid_paragraph(text):
-    text = text.strip()
-    if not text or len(text.split()) < 3:
-        return False
-
-    # Filter obvious noise
-    if re.match(r'^.*\.{4,}.*$', text):
-        return False
-
-    words = text.split()
-    word_count = len(words)
-    part_number_like = 0
-
-    for word in words:
-        cleaned = word.strip(".,;:()[]{}")
-        has_digits = any(char.isdigit() for char in cleaned)
-        long_enough = len(cleaned) > 3
-        if has_digits and long_enough:
-            part_number_like += 1
-
-    part_ratio = part_number_like / word_count if word_count else 0
-    if part_ratio > 0.3:
-        return False
-
-    has_punctuation = any(p in text for p in ['.', ':', ';', '!', '?'])
-    return has_punctuation
-
-
-
-def extract_text_by_columns(page, column_split=300):
-    blocks = page.get_text("blocks")
-    left_col, right_col = [], []
-    for b in blocks:
-        x0, y0, x1, y1, text, *_ = b
-        if x0 < column_split:
-            left_col.append((y0, text))
-        else:
-            right_col.append((y0, text))
-    left_col.sort()
-    right_col.sort()
-    combined_text = '\n'.join([t for _, t in left_col + right_col])
-    return combined_text
-
-def clean_line(line):
-    line = line.strip()
-    if not line or line.count('.') > 10:
-        return ''
-    if re.fullmatch(r'[-–—_\s\d.]+', line):
-        return ''
-    return line
+def pool_size(n_tasks):
+    # cpu_count() ignores affinity masks; sched_getaffinity is Linux-only
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return min(MAX_WORKERS, cpus, n_tasks)
+
+def make_pool(max_workers):
+    # never fork the multi-threaded Streamlit server; forkserver/spawn workers
+    # only import paragraph_extraction (and the guarded app script)
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
 
 def extract_paragraphs_from_pdf(pdf_bytes, use_columns=True, column_split=300):
     try:
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     except Exception as e:
         st.error("❌ Unable to read the PDF. Please check if it's a valid file.")
-        return []
-
-    paragraphs = []
-    for page_num, page in enumerate(doc, start=1):
-        text = extract_text_by_columns(page, column_split) if use_columns else page.get_text("text")
-        lines = [clean_line(line) for line in text.split('\n')]
-        lines = [line for line in lines if line]
-        para_buffer = ""
-        para_num = 0
-        for line in lines:
-            if para_buffer:
-                para_buffer += ' ' + line.strip()
-            else:
-                para_buffer = line.strip()
-            if re.search(r'[.?!:;]$', line.strip()) or len(line.strip()) < 40:
-                if is_valid_paragraph(para_buffer):
-                    para_num += 1
-                    paragraphs.append({
-                        'page': page_num,
-                        'paragraph_number': para_num,
-                        'text': para_buffer.strip(),
-                        'word_count': len(para_buffer.strip().split())
-                    })
-                para_buffer = ""
-        if is_valid_paragraph(para_buffer):
-            para_num += 1
-            paragraphs.append({
-                'page': page_num,
-                'paragraph_number': para_num,
-                'text': para_buffer.strip(),
-                'word_count': len(para_buffer.strip().split())
-            })
+        return {}
+
+    page_count = doc.page_count
+    workers = pool_size(page_count)
+    if page_count < MIN_PARALLEL_PAGES or workers < 2:
+        return extract_paragraphs_from_pages(doc, 0, page_count, use_columns, column_split)
+
+    # paragraph numbers restart on every page, so contiguous page ranges are independent
+    step = -(-page_count // workers)
+    starts = range(0, page_count, step)
+    stops = [min(start + step, page_count) for start in starts]
+    n = len(starts)
+    with make_pool(n) as ex:
+        chunks = list(ex.map(
+            extract_page_range,
+            [pdf_bytes] * n, starts, stops, [use_columns] * n, [column_split] * n
+        ))
+
+    paragraphs = {col: [] for col in chunks[0]}
+    for chunk in chunks:
+        for col, values in chunk.items():
+            paragraphs[col].extend(values)
     return paragraphs
 
 # def detect_languages(paragraphs):
@@ -122,81 +90,219 @@ def extract_paragraphs_from_pdf(pdf_bytes, use_columns=True, column_split=300):
 
 
 def get_language_name(code):
+    # detectors emit ISO 639-1 codes, region-tagged ones (zh-cn) and, for
+    # fastText, some 639-3 codes (ceb, arz); anything else maps to UNKNOWN_LANGUAGE
+    code = code.split('-')[0]
     try:
-        return pycountry.languages.get(alpha_2=code).name
+        lang = pycountry.languages.get(alpha_2=code) or pycountry.languages.get(alpha_3=code)
+        return lang.name
     except:
-        return "Unknown"
-
-def detect_languages(paragraphs):
-    lang_results = []
-    for p in paragraphs:
+        return UNKNOWN_LANGUAGE
+
+@st.cache_resource(show_spinner=False)
+def _load_fasttext_model(path):
+    # failures raise, and st.cache_resource does not cache exceptions, so a
+    # model dropped in later is picked up without restarting the app
+    import fasttext
+    return fasttext.load_model(path)
+
+def load_fasttext_model(path=FASTTEXT_MODEL_PATH):
+    if not os.path.exists(path):
+        logger.warning("fastText model %s not found; using langdetect", path)
+        return None
+    try:
+        return _load_fasttext_model(path)
+    except Exception as e:
+        logger.warning("Could not load fastText model %s (%s); using langdetect", path, e)
+        return None
+
+@st.cache_resource(show_spinner=False)
+def _load_onnx_detector(model_dir):
+    # onnxruntime and transformers are only needed when USE_ONNX_DETECTOR is on
+    import onnxruntime as ort
+    from transformers import AutoConfig, AutoTokenizer
+    session = ort.InferenceSession(
+        os.path.join(model_dir, "model_quantized.onnx"), providers=["CPUExecutionProvider"]
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    missing = {i.name for i in session.get_inputs()} - set(tokenizer.model_input_names)
+    if missing:
+        raise ValueError(f"tokenizer does not produce model inputs {sorted(missing)}")
+    id2label = AutoConfig.from_pretrained(model_dir).id2label
+    if all(get_language_name(label) == UNKNOWN_LANGUAGE for label in id2label.values()):
+        # labels like "English" or "eng_Latn" would make every paragraph Unknown
+        logger.warning(
+            "None of the ONNX model labels in %s are ISO 639 codes; every paragraph "
+            "will be reported as %s", model_dir, UNKNOWN_LANGUAGE
+        )
+    return session, tokenizer, id2label
+
+def load_onnx_detector(model_dir=None):
+    model_dir = model_dir or ONNX_MODEL_DIR
+    try:
+        return _load_onnx_detector(model_dir)
+    except Exception as e:
+        # the user opted in, so say so when we cannot honour it
+        logger.warning("Could not load ONNX detector from %s (%s)", model_dir, e)
+        st.warning(f"⚠️ ONNX language detector unavailable ({e}); using the default detector.")
+        return None
+
+def detect_with_onnx(detector, texts):
+    session, tokenizer, id2label = detector
+    input_names = [i.name for i in session.get_inputs()]
+    lang_codes = []
+    for start in range(0, len(texts), ONNX_BATCH_SIZE):
+        # tokenizing per batch keeps padding to the longest text in the batch
+        encoded = tokenizer(
+            texts[start:start + ONNX_BATCH_SIZE], padding=True, truncation=True,
+            max_length=128, return_tensors="np"
+        )
+        missing = [name for name in input_names if name not in encoded]
+        if missing:
+            raise ValueError(f"tokenizer did not return model inputs {missing}")
+        logits = session.run(None, {name: encoded[name].astype(np.int64) for name in input_names})[0]
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        confident = probs[np.arange(len(best)), best] >= MIN_LANG_CONFIDENCE
+        lang_codes.extend(
+            id2label[int(i)] if ok else "unknown" for i, ok in zip(best, confident)
+        )
+    return lang_codes
+
+def resolve_detector(use_onnx=None):
+    # name of the backend detect_language_codes will use right now; the app
+    # passes it to _analyze so a different backend never hits a cached result
+    if use_onnx is None:
+        use_onnx = USE_ONNX_DETECTOR
+    if use_onnx and load_onnx_detector() is not None:
+        return "onnx"
+    if load_fasttext_model() is not None:
+        return "fasttext"
+    return "langdetect"
+
+def detect_language_codes(texts, detector=None):
+    # resolved at call time so flipping USE_ONNX_DETECTOR takes effect
+    if detector is None:
+        detector = resolve_detector()
+    if detector == "onnx":
         try:
-            lang_code = detect(p['text'])
-            lang_name = get_language_name(lang_code)
-        except Exception:
-            lang_code = "unknown"
-            lang_name = "Unknown"
-        p['language'] = lang_name
-        lang_results.append(lang_name)
+            return detect_with_onnx(load_onnx_detector(), texts)
+        except Exception as e:
+            logger.warning("ONNX language detection failed (%s)", e)
+            st.warning(f"⚠️ ONNX language detection failed ({e}); using the default detector.")
+
+    model = load_fasttext_model() if detector != "langdetect" else None
+    if model is None:
+        # langdetect is pure Python, so spread it over worker processes
+        # once there is enough text to pay for the pool start-up
+        workers = pool_size(len(texts))
+        if len(texts) < MIN_PARALLEL_PARAGRAPHS or workers < 2:
+            return [safe_detect(t) for t in texts]
+        with make_pool(workers) as ex:
+            return list(ex.map(safe_detect, texts, chunksize=32))
+
+    # one batched C++ pass; fastText rejects newlines inside a sample
+    labels, probs = model.predict([t.replace('\n', ' ') for t in texts], k=1)
+    lang_codes = np.array([l[0].replace('__label__', '') for l in labels], dtype=object)
+    lang_codes[np.asarray(probs)[:, 0] < MIN_LANG_CONFIDENCE] = "unknown"
+    return lang_codes.tolist()
+
+def detect_languages(paragraphs, detector=None):
+    # repeated headers, captions and disclaimers are only detected once
+    unique_texts = list(dict.fromkeys(paragraphs['text']))
+    lang_codes = detect_language_codes(unique_texts, detector)
+    lang_by_text = {
+        text: get_language_name(lang_code) for text, lang_code in zip(unique_texts, lang_codes)
+    }
+    lang_results = [lang_by_text[text] for text in paragraphs['text']]
+    paragraphs['language'] = lang_results
     return paragraphs, lang_results
 
 
 
 
-def find_foreign_paragraphs(paragraphs, lang_results):
-    lang_count = Counter(lang_results)
-    if not lang_count:
-        return "unknown", []
+def find_foreign_paragraphs(paragraphs, lang_results, min_word_count=0):
+    langs = np.asarray(lang_results)
+    known = langs != UNKNOWN_LANGUAGE
+    if not known.any():
+        return UNKNOWN_LANGUAGE, {}
 
-    major_language = lang_count.most_common(1)[0][0]
-    foreign_paragraphs = [
-        p for p in paragraphs if p['language'] != major_language and p['language'] != "unknown"
-    ]
+    # undetected paragraphs neither vote for the major language nor count as foreign
+    langs_seen, counts = np.unique(langs[known], return_counts=True)
+    major_language = str(langs_seen[counts.argmax()])
+    foreign_mask = (
+        known
+        & (langs != major_language)
+        & (np.asarray(paragraphs['word_count']) >= min_word_count)
+    )
+    foreign_paragraphs = {
+        col: list(compress(values, foreign_mask)) for col, values in paragraphs.items()
+    }
     return major_language, foreign_paragraphs
 
-def analyze_pdf_language_and_save_bytesio(pdf_bytes, file_name, use_columns=True, column_split=300):
+def columns_to_csv_bytes(columns):
+    # stream rows straight into the byte buffer; utf-8-sig adds the BOM Excel expects
+    buf = io.BytesIO()
+    text_stream = io.TextIOWrapper(buf, encoding='utf-8-sig', newline='', write_through=True)
+    writer = csv.writer(text_stream, lineterminator='\n')
+    writer.writerow(columns)
+    writer.writerows(zip(*columns.values()))
+    text_stream.detach()
+    return buf.getvalue()
+
+def analyze_pdf_language_and_save_bytesio(pdf_bytes, file_name, use_columns=True, column_split=300, detector=None):
     paragraphs = extract_paragraphs_from_pdf(pdf_bytes, use_columns, column_split)
-    if not paragraphs:
-        return "unknown", pd.DataFrame(), b"", ""
+    if not paragraphs.get('text'):
+        return UNKNOWN_LANGUAGE, {}, 0, b"", ""
 
-    paragraphs, lang_results = detect_languages(paragraphs)
-    major_language, foreign_paragraphs = find_foreign_paragraphs(paragraphs, lang_results)
+    paragraphs, lang_results = detect_languages(paragraphs, detector)
+    major_language, foreign_paragraphs = find_foreign_paragraphs(paragraphs, lang_results, min_word_count=10)
 
-    if not foreign_paragraphs:
-        return major_language, pd.DataFrame(), b"", ""
+    n_foreign = len(foreign_paragraphs.get('text', []))
+    if not n_foreign:
+        return major_language, {}, 0, b"", ""
 
-    df_foreign = pd.DataFrame(foreign_paragraphs)
-    clean_df_foreign = df_foreign.loc[df_foreign['word_count']>9]
     output_csv = f"{file_name.replace('.pdf', '')}_foreign.csv"
-    csv_bytes = clean_df_foreign.to_csv(index=False, encoding='utf-8-sig').encode('utf-8-sig')
-    return major_language, clean_df_foreign, csv_bytes, output_csv
-
-# ---------------------- Streamlit App ----------------------
-st.set_page_config(page_title="Foreign Language Detector", layout="centered")
-st.title("📄 Foreign Language Detector")
+    csv_bytes = columns_to_csv_bytes(foreign_paragraphs)
+    return major_language, foreign_paragraphs, n_foreign, csv_bytes, output_csv
 
-uploaded_file = st.file_uploader("Upload a PDF file (<10 MB)", type=["pdf"])
+@st.cache_data(show_spinner=False, max_entries=8)
+def _analyze(pdf_bytes, file_name, detector):
+    # widget interactions re-run the script; identical uploads analysed with
+    # the same detector backend hit the cache
+    return analyze_pdf_language_and_save_bytesio(pdf_bytes, file_name, detector=detector)
 
-if uploaded_file is not None:
-    with st.spinner("Analyzing PDF..."):
-        try:
-            pdf_bytes = uploaded_file.read()
-            major_lang, df, csv_bytes, output_csv = analyze_pdf_language_and_save_bytesio(
-                pdf_bytes, uploaded_file.name
-            )
-
-            if df.empty:
-                st.warning("No foreign language paragraphs were detected.")
-            else:
-                st.success(f"✅ Major language: {major_lang}")
-                st.info(f"Found {len(df)} foreign paragraphs.")
-                st.dataframe(df[['page', 'language', 'text']].head(10))
-                st.download_button(
-                    label="⬇️ Download Foreign Paragraphs CSV",
-                    data=csv_bytes,
-                    file_name=output_csv,
-                    mime="text/csv"
+# ---------------------- Streamlit App ----------------------
+# Under the spawn/forkserver start methods, pool workers re-run this script as
+# __mp_main__; they only need the definitions above, not the UI.
+if __name__ != "__mp_main__":
+    st.set_page_config(page_title="Foreign Language Detector", layout="centered")
+    st.title("📄 Foreign Language Detector")
+
+    uploaded_file = st.file_uploader("Upload a PDF file (<10 MB)", type=["pdf"])
+
+    if uploaded_file is not None:
+        with st.spinner("Analyzing PDF..."):
+            try:
+                pdf_bytes = uploaded_file.read()
+                major_lang, foreign, n_foreign, csv_bytes, output_csv = _analyze(
+                    pdf_bytes, uploaded_file.name, resolve_detector()
                 )
-        except Exception as e:
-            st.error(f"❌ An unexpected error occurred during analysis.")
-            st.exception(e)
\ No newline at end of file
+
+                if not n_foreign:
+                    st.warning("No foreign language paragraphs were detected.")
+                else:
+                    st.success(f"✅ Major language: {major_lang}")
+                    st.info(f"Found {n_foreign} foreign paragraphs.")
+                    # only the preview rows ever become a DataFrame
+                    st.dataframe(pd.DataFrame({col: foreign[col][:10] for col in ('page', 'language', 'text')}))
+                    st.download_button(
+                        label="⬇️ Download Foreign Paragraphs CSV",
+                        data=csv_bytes,
+                        file_name=output_csv,
+                        mime="text/csv"
+                    )
+            except Exception as e:
+                st.error(f"❌ An unexpected error occurred during analysis.")
+                st.exception(e)
\ No newline at end of file
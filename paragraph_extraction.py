@@ -0,0 +1,117 @@
+# Text extraction and paragraph filtering for extract_foreign_paragraphs.py,
+# plus the langdetect wrapper; extract_page_range and safe_detect are the
+# process-pool entry points.
+# Keep this module free of Streamlit calls: worker processes import it to
+# unpickle the functions they run, so anything at module level runs again there.
+import fitz  # PyMuPDF
+import re
+from itertools import chain
+from langdetect import detect
+from langdetect import DetectorFactory
+
+#---------------------setting consistency------
+DetectorFactory.seed = 0
+
+#---------------------compiled patterns------
+_RE_DOTS = re.compile(r'^.*\.{4,}.*$')
+_RE_DASHES = re.compile(r'[-–—_\s\d.]+')
+_SENTENDS = frozenset('.?!:;')
+
+
+def safe_detect(text):
+    try:
+        return detect(text)
+    except Exception:
+        return "unknown"
+
+def is_valid_paragraph(text, word_count):
+    # cheapest rejections first; text arrives already stripped and the caller
+    # has counted its words while building it
+    if word_count < 3 or _SENTENDS.isdisjoint(text):
+        return False
+
+    # Filter obvious noise
+    if _RE_DOTS.match(text):
+        return False
+
+    part_number_like = 0
+    for word in text.split():
+        cleaned = word.strip(".,;:()[]{}")
+        # length test first; the digit scan runs in C via map()
+        if len(cleaned) > 3 and any(map(str.isdigit, cleaned)):
+            part_number_like += 1
+
+    part_ratio = part_number_like / word_count
+    return part_ratio <= 0.3
+
+
+
+def extract_text_by_columns(page, column_split=300):
+    blocks = page.get_text("blocks")
+    left_col, right_col = [], []
+    add_left, add_right = left_col.append, right_col.append
+    for b in blocks:
+        # block tuple: (x0, y0, x1, y1, text, block_no, block_type)
+        if b[0] < column_split:
+            add_left((b[1], b[4]))
+        else:
+            add_right((b[1], b[4]))
+    # order each column by the top edge (y0) of its blocks
+    left_col.sort()
+    right_col.sort()
+    combined_text = '\n'.join(t for _, t in chain(left_col, right_col))
+    return combined_text
+
+def clean_line(line):
+    line = line.strip()
+    if not line or line.count('.') > 10:
+        return ''
+    if _RE_DASHES.fullmatch(line):
+        return ''
+    return line
+
+def extract_paragraphs_from_pages(doc, start, stop, use_columns=True, column_split=300):
+    # one list per column, ready to hand to pandas or the csv writer
+    pages, para_nums, texts, word_counts = [], [], [], []
+    for page_num, page in enumerate(doc.pages(start, stop), start=start + 1):
+        text = extract_text_by_columns(page, column_split) if use_columns else page.get_text("text")
+        para_lines = []
+        para_words = 0
+        para_num = 0
+        for raw_line in text.split('\n'):
+            # clean_line returns the line already stripped, or '' to drop it
+            line = clean_line(raw_line)
+            if not line:
+                continue
+            para_lines.append(line)
+            # lines are joined with a space, so no word spans two lines and the
+            # paragraph count is just the sum of the (short) per-line counts
+            para_words += len(line.split())
+            if line[-1] in _SENTENDS or len(line) < 40:
+                para_text = ' '.join(para_lines)
+                if is_valid_paragraph(para_text, para_words):
+                    para_num += 1
+                    pages.append(page_num)
+                    para_nums.append(para_num)
+                    texts.append(para_text)
+                    word_counts.append(para_words)
+                para_lines.clear()
+                para_words = 0
+        para_text = ' '.join(para_lines)
+        if is_valid_paragraph(para_text, para_words):
+            para_num += 1
+            pages.append(page_num)
+            para_nums.append(para_num)
+            texts.append(para_text)
+            word_counts.append(para_words)
+    return {
+        'page': pages,
+        'paragraph_number': para_nums,
+        'text': texts,
+        'word_count': word_counts
+    }
+
+def extract_page_range(pdf_bytes, start, stop, use_columns, column_split):
+    # worker entry point: MuPDF is not thread-safe, so each process opens its own copy
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    return extract_paragraphs_from_pages(doc, start, stop, use_columns, column_split)